@@ -0,0 +1,66 @@
+import hashlib
+import json
+import os
+import time
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def json_dumps(obj):
+    """Serialize to bytes, via orjson (C, ~3-10x faster) when available."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode()
+
+
+def json_loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class FileCache:
+    """File-backed cache for API responses, one JSON file per key.
+
+    Entries carry a timestamp and expire after a TTL, so fundamentals
+    (which change quarterly) and prices (daily) can use different
+    lifetimes. A hit replaces a multi-second HTTP round-trip with a
+    local read.
+    """
+
+    def __init__(self, cache_dir=".cache", ttl_days=90):
+        self.cache_dir = cache_dir
+        self.ttl_days = ttl_days
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def make_key(self, endpoint, symbol, params=None):
+        digest = hashlib.md5(
+            json.dumps(params or {}, sort_keys=True).encode()
+        ).hexdigest()
+        return f"{endpoint}_{symbol}_{digest}"
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + ".json")
+
+    def get(self, key, ttl_days=None):
+        """Return the cached payload, or None if missing/expired/corrupt."""
+        path = self._path(key)
+        ttl = self.ttl_days if ttl_days is None else ttl_days
+        try:
+            with open(path, "rb") as f:
+                entry = json_loads(f.read())
+        except (OSError, ValueError):
+            return None
+        if time.time() - entry.get("timestamp", 0) > ttl * 86400:
+            return None
+        return entry.get("payload")
+
+    def set(self, key, payload):
+        path = self._path(key)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(json_dumps({"timestamp": time.time(), "payload": payload}))
+        os.replace(tmp, path)
@@ -1,19 +1,127 @@
+import asyncio
+import gzip
 import json
+from concurrent.futures import ProcessPoolExecutor
 import os
+import random
+import subprocess
 import sys
+import threading
 import time
 from datetime import datetime, timezone
 
 try:
     import yfinance as yf
 except ImportError:
-    os.system("pip install yfinance --break-system-packages -q")
+    # Installing mid-run costs up to 30s on every cold launch; only do it
+    # when explicitly asked, otherwise fail fast with the fix.
+    if "--bootstrap" not in sys.argv:
+        sys.exit("yfinance is not installed. Run 'pip install -r "
+                 "requirements.txt', or rerun with --bootstrap.")
+    subprocess.run([sys.executable, "-m", "pip", "install", "--quiet",
+                    "-r", "requirements.txt"], check=True)
     import yfinance as yf
 
+import numpy as np
+import pandas as pd
+import requests
+
+try:
+    import ijson
+except ImportError:
+    ijson = None  # optional; migration falls back to a full json load
+
+from cache import FileCache, json_dumps, json_loads
+
 BATCH_SIZE = 50
-DATA_FILE = "buyback_data.json"
+MAX_AGE_DAYS = 7  # re-fetch horizon for tickers already collected
+CONCURRENCY_LIMIT = 8
+RATE_LIMIT_QPS = 2.0  # same budget as the old 0.5s spacing, minus the dead time
+RATE_LIMIT_BURST = 5
+DATA_FILE = "buyback_data.json"  # combined artifact served to index.html
+DATA_DIR = "data"  # per-ticker store, one JSON file per symbol
+META_FILE = "meta.json"
 TICKERS_FILE = "sp500_tickers.json"
 
+# Fundamentals move once a quarter, prices move daily.
+FUNDAMENTALS_TTL_DAYS = 90
+PRICE_TTL_DAYS = 1
+HIST_PARAMS = {"period": "5y", "interval": "1mo"}
+
+# Quarters are stored columnar (one list per field) rather than as a dict
+# per quarter: no repeated key strings on disk, and numeric fields are
+# np.array-able directly. shares_diluted was always a copy of
+# shares_outstanding, so it is gone.
+QUARTER_FIELDS = ("date", "period", "year", "buyback_amount",
+                  "shares_outstanding", "free_cash_flow", "price")
+
+# Candidate statement rows in priority order; yfinance key spellings vary
+# across tickers. Built once instead of per fetch_buyback_data call.
+BUYBACK_KEYS = ('Repurchase Of Capital Stock', 'Common Stock Repurchased',
+                'RepurchaseOfCapitalStock')
+FCF_KEYS = ('Free Cash Flow', 'FreeCashFlow')
+SHARES_CF_KEYS = ('Diluted Average Shares', 'Basic Average Shares')
+BS_SHARES_KEYS = ('Ordinary Shares Number', 'Share Issued',
+                  'Common Stock Shares Outstanding', 'OrdinarySharesNumber')
+
+
+def quarters_to_records(cols):
+    """Columnar quarters -> list of per-quarter dicts (legacy row shape)."""
+    keys = list(cols)
+    return [dict(zip(keys, vals)) for vals in zip(*cols.values())]
+
+
+def records_to_quarters(records):
+    """Legacy per-quarter dicts -> columnar quarters."""
+    return {field: [q.get(field, 0) for q in records]
+            for field in QUARTER_FIELDS}
+
+
+CACHE = FileCache(cache_dir=".cache", ttl_days=FUNDAMENTALS_TTL_DAYS)
+FORCE_REFRESH = "--force-refresh" in sys.argv
+
+# One session for the whole run: keep-alive + TLS resumption instead of a
+# fresh handshake per ticker. Pool sized to match the concurrency cap.
+SESSION = requests.Session()
+SESSION.headers["User-Agent"] = "sp500-buyback-tracker/1.0"
+SESSION.mount("https://", requests.adapters.HTTPAdapter(
+    pool_connections=CONCURRENCY_LIMIT, pool_maxsize=CONCURRENCY_LIMIT))
+
+
+def _df_to_payload(df):
+    """DataFrame -> JSON-safe dict via to_dict('split')."""
+    payload = df.to_dict("split")
+    payload["columns"] = [str(c) for c in payload["columns"]]
+    payload["index"] = [str(i) for i in payload["index"]]
+    return payload
+
+
+def _df_from_payload(payload, datetime_axis):
+    """Rebuild a DataFrame, restoring Timestamps on the given axis."""
+    df = pd.DataFrame(
+        payload["data"], index=payload["index"], columns=payload["columns"]
+    )
+    # orjson stores NaN as null; coerce back to float so the frame stays numeric
+    df = df.apply(pd.to_numeric, errors="coerce")
+    if datetime_axis == "columns":
+        df.columns = pd.to_datetime(df.columns)
+    else:
+        df.index = pd.to_datetime(df.index, utc=True)
+    return df
+
+
+def _cached_df(endpoint, symbol, params, ttl_days, fetch, datetime_axis):
+    """Fetch a DataFrame through the file cache."""
+    key = CACHE.make_key(endpoint, symbol, params)
+    if not FORCE_REFRESH:
+        payload = CACHE.get(key, ttl_days=ttl_days)
+        if payload is not None:
+            return _df_from_payload(payload, datetime_axis)
+    df = with_retries(fetch)
+    if df is not None and not df.empty:
+        CACHE.set(key, _df_to_payload(df))
+    return df
+
 
 def load_sp500_list():
     """Load S&P 500 list from local JSON file."""
@@ -27,13 +135,151 @@ def load_sp500_list():
     return data
 
 
-def fetch_buyback_data(symbol):
+class TokenBucket:
+    """Thread-safe token bucket: blocks only once the rate is exhausted.
+
+    Unlike a fixed sleep per request, fast responses spend banked
+    tokens immediately; waiting happens only when the sustained rate
+    would exceed RATE_LIMIT_QPS.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity,
+                              self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= 1
+            # Negative balance queues concurrent waiters fairly.
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+
+
+BUCKET = TokenBucket(RATE_LIMIT_QPS, RATE_LIMIT_BURST)
+
+# Shared across worker threads; surfaced in the run summary.
+COUNTERS = {"rate_limited": 0}
+_counter_lock = threading.Lock()
+
+
+def _is_transient(exc):
+    """429s, 5xx and connection-level failures are worth retrying; plain
+    4xx (bad symbol, no data) are not."""
+    if isinstance(exc, (requests.ConnectionError, requests.Timeout)):
+        return True
+    msg = str(exc)
+    return any(code in msg for code in ("429", "500", "502", "503", "504"))
+
+
+def with_retries(fn, attempts=3, base=0.5):
+    """Run fn, retrying transient failures with exponential backoff + jitter."""
+    for i in range(attempts):
+        try:
+            return fn()
+        except Exception as e:
+            if "429" in str(e):
+                with _counter_lock:
+                    COUNTERS["rate_limited"] += 1
+            if i == attempts - 1 or not _is_transient(e):
+                raise
+            delay = base * 2 ** i + random.random() * 0.1
+            retry_after = getattr(getattr(e, "response", None),
+                                  "headers", {}).get("Retry-After")
+            if retry_after:
+                try:
+                    delay = max(delay, float(retry_after))
+                except ValueError:
+                    pass
+            time.sleep(delay)
+
+
+def build_month_index(data_dict):
+    """Sort a {'YYYY-MM': value} dict into parallel arrays for searchsorted.
+
+    Months are encoded as year*12+month so distances between keys are
+    plain integer differences.
+    """
+    if not data_dict:
+        return np.empty(0, dtype=np.int32), np.empty(0)
+    keys = sorted(data_dict)
+    months = np.fromiter((int(k[:4]) * 12 + int(k[5:7]) for k in keys),
+                         dtype=np.int32, count=len(keys))
+    vals = np.fromiter((data_dict[k] for k in keys),
+                       dtype=np.float64, count=len(keys))
+    return months, vals
+
+
+def find_nearby(months, vals, date_key, max_gap=3):
+    """Value for the month closest to date_key within max_gap, else 0."""
+    if not len(months):
+        return 0
+    target = int(date_key[:4]) * 12 + int(date_key[5:7])
+    i = np.searchsorted(months, target)
+    best, gap = 0, max_gap + 1
+    for j in (i, i - 1):  # the two neighbors of the insertion point
+        if 0 <= j < len(months):
+            d = abs(int(months[j]) - target)
+            if d < gap:
+                best, gap = vals[j], d
+    return float(best) if gap <= max_gap else 0
+
+
+def prefetch_price_histories(batch_symbols):
+    """Warm the price cache with one bulk yf.download for the whole batch.
+
+    Collapses up to 50 per-ticker history calls into a single request;
+    per-ticker fetches remain as the fallback for anything missing.
+    """
+    misses = [
+        s for s in batch_symbols
+        if FORCE_REFRESH or CACHE.get(CACHE.make_key("history", s, HIST_PARAMS),
+                                      ttl_days=PRICE_TTL_DAYS) is None
+    ]
+    if not misses:
+        return
+    BUCKET.acquire()
+    try:
+        hist_all = yf.download(tickers=misses, group_by="ticker", threads=True,
+                               progress=False, session=SESSION, **HIST_PARAMS)
+    except Exception as e:
+        print(f"Bulk price download failed ({e}); using per-ticker fetches")
+        return
+    if hist_all is None or hist_all.empty:
+        return
+    for symbol in misses:
+        try:
+            # group_by="ticker" yields MultiIndex columns even for a single
+            # miss on modern yfinance; older versions return a flat frame.
+            if isinstance(hist_all.columns, pd.MultiIndex):
+                hist = hist_all[symbol]
+            else:
+                hist = hist_all
+        except KeyError:
+            continue
+        hist = hist.dropna(how="all")
+        if not hist.empty:
+            CACHE.set(CACHE.make_key("history", symbol, HIST_PARAMS),
+                      _df_to_payload(hist))
+
+
+def fetch_buyback_data(symbol, ticker=None):
     """Fetch quarterly cash flow + shares + price using yfinance."""
     try:
-        ticker = yf.Ticker(symbol)
+        BUCKET.acquire()
+        if ticker is None:
+            ticker = yf.Ticker(symbol, session=SESSION)
 
         # Get quarterly cash flow statement
-        cf = ticker.quarterly_cashflow
+        cf = _cached_df("quarterly_cashflow", symbol, None, FUNDAMENTALS_TTL_DAYS,
+                        lambda: ticker.quarterly_cashflow, "columns")
         if cf is None or cf.empty:
             return None
 
@@ -46,45 +292,41 @@ def fetch_buyback_data(symbol):
         # Get shares outstanding from balance sheet (more reliable)
         shares_data = {}
         try:
-            bs = ticker.quarterly_balance_sheet
+            bs = _cached_df("quarterly_balance_sheet", symbol, None,
+                            FUNDAMENTALS_TTL_DAYS,
+                            lambda: ticker.quarterly_balance_sheet, "columns")
             if bs is not None and not bs.empty:
-                for col in bs.columns:
-                    dk = col.strftime("%Y-%m") if hasattr(col, 'strftime') else str(col)[:7]
-                    for key in ['Ordinary Shares Number', 'Share Issued',
-                                'Common Stock Shares Outstanding', 'OrdinarySharesNumber']:
-                        if key in bs.index:
-                            val = bs.loc[key, col]
-                            if val is not None and str(val) != 'nan' and float(val) > 0:
-                                shares_data[dk] = float(val)
-                                break
+                # One reindex selects the candidate rows in priority order;
+                # bfill collapses them into the first non-NaN value per column.
+                shares_bs = bs.reindex(BS_SHARES_KEYS).bfill().iloc[0]
+                vals = shares_bs.to_numpy(dtype=float)
+                mask = vals > 0  # NaN compares False, so this also drops NaNs
+                shares_data = dict(zip(shares_bs.index.strftime("%Y-%m")[mask],
+                                       vals[mask]))
         except Exception:
             pass
 
         # Get monthly closing prices
         prices = {}
         try:
-            hist = ticker.history(period="5y", interval="1mo")
+            hist = _cached_df("history", symbol, HIST_PARAMS, PRICE_TTL_DAYS,
+                              lambda: ticker.history(**HIST_PARAMS), "index")
             if hist is not None and not hist.empty:
-                for idx, row in hist.iterrows():
-                    prices[idx.strftime("%Y-%m")] = round(float(row['Close']), 2)
+                prices = dict(zip(hist.index.strftime("%Y-%m"),
+                                  hist['Close'].round(2).tolist()))
         except Exception:
             pass
 
-        def find_nearby(data_dict, date_key):
-            """Find value in dict, trying nearby months if exact match missing."""
-            if date_key in data_dict:
-                return data_dict[date_key]
-            y, m = int(date_key[:4]), int(date_key[5:7])
-            for offset in [1, -1, 2, -2, 3, -3]:
-                nm = m + offset
-                ny = y + (nm - 1) // 12
-                nm = ((nm - 1) % 12) + 1
-                alt = f"{ny}-{nm:02d}"
-                if alt in data_dict:
-                    return data_dict[alt]
-            return 0
-
-        quarters = []
+        shares_months, shares_vals = build_month_index(shares_data)
+        price_months, price_vals = build_month_index(prices)
+
+        # Select each candidate row set once instead of probing cf.loc per
+        # column; bfill keeps the priority order of the key lists.
+        bb_row = cf.reindex(BUYBACK_KEYS).bfill().iloc[0]
+        fcf_row = cf.reindex(FCF_KEYS).bfill().iloc[0]
+        shares_cf_row = cf.reindex(SHARES_CF_KEYS).bfill().iloc[0]
+
+        quarters = {field: [] for field in QUARTER_FIELDS}
         for col in cf.columns:
             date_str = col.strftime("%Y-%m-%d") if hasattr(col, 'strftime') else str(col)[:10]
             year = str(col.year) if hasattr(col, 'year') else date_str[:4]
@@ -93,49 +335,32 @@ def fetch_buyback_data(symbol):
             q_key = date_str[:7]
 
             # Buyback amount
-            buyback = 0
-            for key in ['Repurchase Of Capital Stock', 'Common Stock Repurchased',
-                        'RepurchaseOfCapitalStock']:
-                if key in cf.index:
-                    val = cf.loc[key, col]
-                    if val is not None and str(val) != 'nan':
-                        buyback = float(val)
-                        break
+            val = bb_row[col]
+            buyback = float(val) if pd.notna(val) else 0
 
             # Shares: balance sheet > cash flow > fast_info
-            shares = find_nearby(shares_data, q_key)
+            shares = find_nearby(shares_months, shares_vals, q_key)
             if shares == 0:
-                for key in ['Diluted Average Shares', 'Basic Average Shares']:
-                    if key in cf.index:
-                        val = cf.loc[key, col]
-                        if val is not None and str(val) != 'nan' and float(val) > 0:
-                            shares = float(val)
-                            break
+                val = shares_cf_row[col]
+                if pd.notna(val) and float(val) > 0:
+                    shares = float(val)
             if shares == 0:
                 shares = current_shares
 
             # Free cash flow
-            fcf = 0
-            for key in ['Free Cash Flow', 'FreeCashFlow']:
-                if key in cf.index:
-                    val = cf.loc[key, col]
-                    if val is not None and str(val) != 'nan':
-                        fcf = float(val)
-                        break
+            val = fcf_row[col]
+            fcf = float(val) if pd.notna(val) else 0
 
             # Price
-            price = find_nearby(prices, q_key)
-
-            quarters.append({
-                "date": date_str,
-                "period": f"Q{q_num}",
-                "year": year,
-                "buyback_amount": buyback,
-                "shares_outstanding": shares,
-                "shares_diluted": shares,
-                "free_cash_flow": fcf,
-                "price": price,
-            })
+            price = find_nearby(price_months, price_vals, q_key)
+
+            quarters["date"].append(date_str)
+            quarters["period"].append(f"Q{q_num}")
+            quarters["year"].append(year)
+            quarters["buyback_amount"].append(buyback)
+            quarters["shares_outstanding"].append(shares)
+            quarters["free_cash_flow"].append(fcf)
+            quarters["price"].append(price)
 
         return {"quarters": quarters, "market_cap": market_cap, "current_price": current_price}
 
@@ -144,42 +369,269 @@ def fetch_buyback_data(symbol):
         return None
 
 
-def load_data():
-    if os.path.exists(DATA_FILE):
-        with open(DATA_FILE, "r") as f:
-            return json.load(f)
+async def fetch_batch(batch_symbols):
+    """Fetch a batch of tickers concurrently, capped by a semaphore.
+
+    yfinance is synchronous, so each fetch runs in a worker thread; the
+    semaphore bounds how many are in flight and the shared token bucket
+    keeps the aggregate request rate under Yahoo's limits.
+    """
+    semaphore = asyncio.Semaphore(CONCURRENCY_LIMIT)
+    fetch = DATA_SOURCES[SOURCE]
+    # One Tickers container so fundamentals share a single session/crumb.
+    tickers = (yf.Tickers(" ".join(batch_symbols), session=SESSION)
+               if SOURCE == "yfinance" else None)
+
+    async def fetch_one(symbol):
+        async with semaphore:
+            return await asyncio.to_thread(
+                fetch, symbol, tickers.tickers.get(symbol) if tickers else None)
+
+    return await asyncio.gather(*[fetch_one(s) for s in batch_symbols])
+
+
+def _init_worker(rate):
+    """Give each child its own session and slice of the rate budget.
+
+    The pool forks after the parent has already used SESSION, so a
+    child must not reuse the inherited keep-alive sockets - two workers
+    sharing one TCP stream would interleave requests.
+    """
+    global BUCKET, SESSION
+    BUCKET = TokenBucket(rate, 1)
+    SESSION = requests.Session()
+    SESSION.headers["User-Agent"] = "sp500-buyback-tracker/1.0"
+
+
+def _fetch_counted(symbol):
+    """Fetch plus the 429 count this call added, since child-process
+    COUNTERS increments never reach the parent."""
+    before = COUNTERS["rate_limited"]
+    result = DATA_SOURCES[SOURCE](symbol)
+    return result, COUNTERS["rate_limited"] - before
+
+
+def fetch_batch_processes(batch_symbols, workers):
+    """Fan per-ticker work out across processes (opt-in via FETCH_PROCS).
+
+    With responses mostly cached or prefetched, the remaining cost is
+    pandas parsing, which holds the GIL; processes spread it over
+    cores. Workers share the file cache through disk (writes are
+    atomic) and split the token-bucket rate so the aggregate request
+    budget is unchanged.
+    """
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(RATE_LIMIT_QPS / workers,)) as ex:
+        pairs = list(ex.map(_fetch_counted, batch_symbols))
+    with _counter_lock:
+        COUNTERS["rate_limited"] += sum(n for _, n in pairs)
+    return [result for result, _ in pairs]
+
+
+def _calendar_quarter(dt):
+    return dt.year * 4 + (dt.month - 1) // 3
+
+
+def should_skip(meta, symbol, now_dt):
+    """Skip tickers fetched within MAX_AGE_DAYS, unless a calendar quarter
+    boundary has passed since the fetch (new filings may have landed)."""
+    fetched = meta.get("fetched_at", {}).get(symbol)
+    if not fetched:
+        return False
+    try:
+        fetched_dt = datetime.fromisoformat(fetched.replace("Z", "+00:00"))
+    except ValueError:
+        return False
+    if (now_dt - fetched_dt).days >= MAX_AGE_DAYS:
+        return False
+    return _calendar_quarter(fetched_dt) == _calendar_quarter(now_dt)
+
+
+# Single entrypoint for all data backends. Earlier iterations kept a
+# separate copy of this script per provider (yfinance rich/lean, FMP),
+# which drifted apart; only the yfinance path survives in this tree.
+# A new provider registers a fetch(symbol, ticker=None) -> result
+# callable here and is selected with SOURCE=<name>, sharing all the
+# caching, rate-limiting, retry and persistence machinery in main().
+DATA_SOURCES = {"yfinance": fetch_buyback_data}
+SOURCE = os.environ.get("SOURCE", "yfinance")
+
+
+def load_meta():
+    if os.path.exists(META_FILE):
+        with open(META_FILE, "rb") as f:
+            return json_loads(f.read())
     return {
         "last_updated": "",
         "batch_index": 0,
         "total_batches": 0,
-        "sp500_list": [],
-        "data": {},
         "collection_started": "",
         "full_cycles_completed": 0,
     }
 
 
-def save_data(data):
-    with open(DATA_FILE, "w") as f:
-        json.dump(data, f)
+def save_meta(meta):
+    tmp = META_FILE + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(json_dumps(meta))
+    os.replace(tmp, META_FILE)
+
+
+_TICKER_SUFFIXES = (".json.gz", ".json")
+
+
+def ticker_path(symbol):
+    return os.path.join(DATA_DIR, f"{symbol}.json.gz")
+
+
+def _ticker_name(fname):
+    """Symbol for a store filename, or None for non-store files."""
+    for suffix in _TICKER_SUFFIXES:
+        if fname.endswith(suffix):
+            return fname[: -len(suffix)]
+    return None
+
+
+def _read_ticker_bytes(path):
+    """Raw JSON bytes of a store file, decompressing .gz transparently."""
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rb") as f:
+        return f.read()
+
+
+def save_ticker(symbol, entry):
+    """Atomically write one ticker's entry; O(batch) I/O instead of O(DB).
+
+    compresslevel=3 keeps the CPU cost well under the serializer's rate
+    while shrinking the highly repetitive JSON ~5-10x.
+    """
+    os.makedirs(DATA_DIR, exist_ok=True)
+    path = ticker_path(symbol)
+    tmp = path + ".tmp"
+    with gzip.open(tmp, "wb", compresslevel=3) as f:
+        f.write(json_dumps(entry))
+    os.replace(tmp, path)
+    legacy = path[:-3]  # pre-gzip plain file, superseded by this write
+    if os.path.exists(legacy):
+        os.remove(legacy)
+
+
+def migrate_legacy_db():
+    """One-time split of the monolithic buyback_data.json into data/*.json.
+
+    With ijson installed the file is streamed entry by entry, so peak
+    memory stays at one ticker instead of the whole DB.
+    """
+    if os.path.isdir(DATA_DIR) or not os.path.exists(DATA_FILE):
+        return
+    print(f"Migrating legacy {DATA_FILE} to per-ticker files...")
+    meta = {}
+    flags = {}
+    fetched_at = {}
+
+    def split_entry(symbol, entry):
+        if entry.get("last_fetched"):
+            fetched_at[symbol] = entry["last_fetched"]
+        quarters = entry.get("quarters", [])
+        if isinstance(quarters, list):  # legacy row dicts -> columnar
+            quarters = records_to_quarters(quarters)
+            entry = {**entry, "quarters": quarters}
+        save_ticker(symbol, entry)
+        flags[symbol] = any(bb < 0 for bb in quarters.get("buyback_amount", []))
+
+    if ijson is not None:
+        # Top-level scalars (last_updated, batch_index, ...) only.
+        with open(DATA_FILE, "rb") as f:
+            for prefix, event, value in ijson.parse(f):
+                if prefix and "." not in prefix and event in (
+                        "string", "number", "boolean"):
+                    if event == "number":  # ijson yields Decimal
+                        value = int(value) if value % 1 == 0 else float(value)
+                    meta[prefix] = value
+        with open(DATA_FILE, "rb") as f:
+            for symbol, entry in ijson.kvitems(f, "data", use_float=True):
+                split_entry(symbol, entry)
+    else:
+        with open(DATA_FILE, "rb") as f:
+            legacy = json_loads(f.read())
+        meta = {k: v for k, v in legacy.items()
+                if k not in ("data", "sp500_list")}
+        for symbol, entry in legacy.get("data", {}).items():
+            split_entry(symbol, entry)
+
+    meta["buyback_flags"] = flags
+    meta["fetched_at"] = fetched_at
+    save_meta(meta)
+
+
+def rebuild_buyback_flags():
+    """Full rescan fallback (schema change / missing flags): stream the
+    per-ticker files and recompute has-buybacks per symbol."""
+    flags = {}
+    if not os.path.isdir(DATA_DIR):
+        return flags
+    for name in os.listdir(DATA_DIR):
+        symbol = _ticker_name(name)
+        if symbol is None:
+            continue
+        entry = json_loads(_read_ticker_bytes(os.path.join(DATA_DIR, name)))
+        quarters = entry.get("quarters") or {}
+        if isinstance(quarters, list):  # pre-columnar file
+            quarters = records_to_quarters(quarters)
+        amounts = np.asarray(quarters.get("buyback_amount", []),
+                             dtype=np.float64)
+        flags[symbol] = bool((amounts < 0).any())
+    return flags
+
+
+def export_dashboard(meta, sp500):
+    """Rebuild the combined artifact that index.html fetches.
+
+    Stitches raw per-ticker file bytes into the "data" object, so the
+    export never parses or holds the full DB in memory.
+    """
+    tmp = DATA_FILE + ".tmp"
+    with open(tmp, "wb") as f:
+        header = dict(meta)
+        header["sp500_list"] = sp500
+        f.write(json_dumps(header)[:-1])  # keep the object open
+        f.write(b', "data": {')
+        first = True
+        for name in sorted(os.listdir(DATA_DIR)) if os.path.isdir(DATA_DIR) else []:
+            symbol = _ticker_name(name)
+            if symbol is None:
+                continue
+            if not first:
+                f.write(b", ")
+            f.write(json_dumps(symbol) + b": ")
+            f.write(_read_ticker_bytes(os.path.join(DATA_DIR, name)))
+            first = False
+        f.write(b"}}")
+    os.replace(tmp, DATA_FILE)
     size_mb = os.path.getsize(DATA_FILE) / (1024 * 1024)
     print(f"Data saved to {DATA_FILE} ({size_mb:.1f} MB)")
 
 
 def main():
-    db = load_data()
-    now = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    if SOURCE not in DATA_SOURCES:
+        sys.exit(f"Unknown SOURCE {SOURCE!r}; available: "
+                 f"{', '.join(DATA_SOURCES)}")
+    migrate_legacy_db()
+    meta = load_meta()
+    if "buyback_flags" not in meta:
+        meta["buyback_flags"] = rebuild_buyback_flags()
+    now_dt = datetime.now(timezone.utc)
+    now = now_dt.strftime("%Y-%m-%dT%H:%M:%SZ")
 
     sp500 = load_sp500_list()
     if not sp500:
         print("Failed to load S&P 500 list. Exiting.")
         sys.exit(1)
 
-    db["sp500_list"] = sp500
     symbols = [s["symbol"] for s in sp500]
     total_batches = (len(symbols) + BATCH_SIZE - 1) // BATCH_SIZE
 
-    batch_index = db.get("batch_index", 0) % total_batches
+    batch_index = meta.get("batch_index", 0) % total_batches
     start = batch_index * BATCH_SIZE
     end = min(start + BATCH_SIZE, len(symbols))
     batch_symbols = symbols[start:end]
@@ -191,13 +643,27 @@ def main():
     success_count = 0
     fail_count = 0
 
-    for i, symbol in enumerate(batch_symbols):
-        print(f"  [{i+1}/{len(batch_symbols)}] Fetching {symbol}...", end=" ")
-        result = fetch_buyback_data(symbol)
+    to_fetch = [s for s in batch_symbols
+                if FORCE_REFRESH or not should_skip(meta, s, now_dt)]
+    skipped_count = len(batch_symbols) - len(to_fetch)
+    if skipped_count:
+        print(f"  Skipping {skipped_count} up-to-date tickers")
+    results = []
+    if to_fetch:
+        if SOURCE == "yfinance":
+            prefetch_price_histories(to_fetch)
+        procs = int(os.environ.get("FETCH_PROCS", "0"))
+        if procs > 1:
+            results = fetch_batch_processes(to_fetch, procs)
+        else:
+            results = asyncio.run(fetch_batch(to_fetch))
+
+    for i, (symbol, result) in enumerate(zip(to_fetch, results)):
+        print(f"  [{i+1}/{len(to_fetch)}] {symbol}:", end=" ")
 
-        if result and result["quarters"]:
+        if result and result["quarters"]["date"]:
             info = info_lookup.get(symbol, {})
-            db["data"][symbol] = {
+            save_ticker(symbol, {
                 "name": info.get("name", symbol),
                 "sector": info.get("sector", "Unknown"),
                 "subSector": "",
@@ -205,42 +671,46 @@ def main():
                 "market_cap": result["market_cap"],
                 "current_price": result["current_price"],
                 "last_fetched": now,
-            }
-            buyback_total = sum(abs(min(q["buyback_amount"], 0)) for q in result["quarters"])
-            has_shares = any(q["shares_outstanding"] > 0 for q in result["quarters"])
-            has_price = any(q.get("price", 0) > 0 for q in result["quarters"])
-            print(f"OK ({len(result['quarters'])}Q, bb:${buyback_total/1e9:.1f}B, shares:{'✓' if has_shares else '✗'}, price:{'✓' if has_price else '✗'})")
+            })
+            meta.setdefault("fetched_at", {})[symbol] = now
+            quarters = result["quarters"]
+            bb = np.asarray(quarters["buyback_amount"], dtype=np.float64)
+            buyback_total = float(-np.minimum(bb, 0).sum())
+            meta["buyback_flags"][symbol] = buyback_total > 0
+            has_shares = any(s > 0 for s in quarters["shares_outstanding"])
+            has_price = any(p > 0 for p in quarters["price"])
+            print(f"OK ({len(quarters['date'])}Q, bb:${buyback_total/1e9:.1f}B, shares:{'✓' if has_shares else '✗'}, price:{'✓' if has_price else '✗'})")
             success_count += 1
         else:
             print("FAILED")
             fail_count += 1
 
-        time.sleep(0.5)
+    meta["last_updated"] = now
+    meta["batch_index"] = (batch_index + 1) % total_batches
+    meta["total_batches"] = total_batches
 
-    db["last_updated"] = now
-    db["batch_index"] = (batch_index + 1) % total_batches
-    db["total_batches"] = total_batches
-
-    if not db["collection_started"]:
-        db["collection_started"] = now
+    if not meta["collection_started"]:
+        meta["collection_started"] = now
 
     if batch_index + 1 == total_batches:
-        db["full_cycles_completed"] = db.get("full_cycles_completed", 0) + 1
-        print(f"\n🎉 Full cycle completed! (#{db['full_cycles_completed']})")
+        meta["full_cycles_completed"] = meta.get("full_cycles_completed", 0) + 1
+        print(f"\n🎉 Full cycle completed! (#{meta['full_cycles_completed']})")
 
-    total_tickers_collected = len(db["data"])
-    total_with_buybacks = sum(
-        1 for v in db["data"].values()
-        if any(q["buyback_amount"] < 0 for q in v.get("quarters", []))
-    )
+    # Maintained incrementally per fetch; no O(tickers x quarters) rescan.
+    total_tickers_collected = len(meta["buyback_flags"])
+    total_with_buybacks = sum(meta["buyback_flags"].values())
 
     print(f"\n--- Summary ---")
     print(f"  Tickers collected: {total_tickers_collected}/{len(symbols)}")
     print(f"  With buyback activity: {total_with_buybacks}")
-    print(f"  Success: {success_count}, Failed: {fail_count}")
-    print(f"  Next batch: {db['batch_index']}")
-
-    save_data(db)
+    print(f"  Success: {success_count}, Failed: {fail_count}, Skipped: {skipped_count}")
+    if COUNTERS["rate_limited"]:
+        print(f"  Rate limited: {COUNTERS['rate_limited']} "
+              f"(consider lowering CONCURRENCY_LIMIT / RATE_LIMIT_QPS)")
+    print(f"  Next batch: {meta['batch_index']}")
+
+    save_meta(meta)
+    export_dashboard(meta, sp500)
 
 
 if __name__ == "__main__":